@@ -1,36 +1,56 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, subprocess, sys
+import subprocess, sys
 import os
 
+# 子进程统一环境：跳过 user site、不写 .pyc，减小每次 CPython 启动开销
+CHILD_ENV = {**os.environ, "PYTHONNOUSERSITE": "1", "PYTHONDONTWRITEBYTECODE": "1"}
+
 def sh(cmd):
     print(">>", " ".join(cmd))
-    r = subprocess.run(cmd)
+    r = subprocess.run(cmd, env=CHILD_ENV)
     if r.returncode != 0:
         sys.exit(r.returncode)
 
 def main():
+    # argparse 只在真正作为脚本运行时才导入，降低被 import 时的冷启动
+    import argparse
     ap = argparse.ArgumentParser(description="Run gprMax once (-n N), merge, plot PNG using official plot_Bscan.")
     ap.add_argument("--infile", required=True, help=".in file (contains #src_steps/#rx_steps)")
     ap.add_argument("--runs", type=int, required=True, help="N for -n (e.g., 60)")
     ap.add_argument("--gpu", type=int, help="GPU id")
     ap.add_argument("--comp", default="Ez", help="field component, default Ez")
+    ap.add_argument("--geometry-fixed", action="store_true", help="pass --geometry-fixed to gprMax (skip geometry rebuild per run)")
+    ap.add_argument("--wait-plot", action="store_true", help="block until the B-scan PNG is written (default: plot in a background process)")
     args = ap.parse_args()
 
     # 1) simulate once with -n
     cmd = [sys.executable, "-m", "gprMax", args.infile, "-n", str(args.runs)]
-    if args.gpu is not None: 
+    if args.gpu is not None:
         cmd += ["-gpu", str(args.gpu)]
+    if args.geometry_fixed:
+        cmd.append("--geometry-fixed")
     sh(cmd)
 
     # 2) merge (prefix = infile without extension)
-    prefix = args.infile.rsplit(".",1)[0]
+    # splitext 而非 rsplit("."): 目录名带 "." 时也正确
+    prefix = os.path.splitext(args.infile)[0]
     sh([sys.executable, "-m", "tools.outputfiles_merge", prefix, "--remove-files"])
     merged = f"{prefix}_merged.out"
 
     # 3) plot using official plot_Bscan
     print(f"Plotting B-scan using official plot_Bscan.py...")
-    sh([sys.executable, "-m", "tools.plot_Bscan", merged, args.comp])
+    plot_cmd = [sys.executable, "-m", "tools.plot_Bscan", merged, args.comp]
+    if args.wait_plot:
+        sh(plot_cmd)
+    else:
+        # 出图放到脱离会话的后台进程：matplotlib 导入+渲染不再阻塞脚本返回
+        log = f"{prefix}_plot.log"
+        print(">> (background)", " ".join(plot_cmd))
+        with open(log, "w") as lf:
+            subprocess.Popen(plot_cmd, start_new_session=True, stdout=lf, stderr=subprocess.STDOUT,
+                             env={**CHILD_ENV, "MPLBACKEND": "Agg"})
+        print(f"Plotting in background; log: {log}")
 
 if __name__ == "__main__":
     main()
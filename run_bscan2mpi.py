@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, subprocess, sys, os, math, shutil, time
+import argparse, subprocess, sys, os, time, threading, queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# h5py 必须在模块顶层导入：merger 线程里做函数级 import 时，
+# 若恰逢 GPU 工作进程 fork，子进程会继承被持有的 import 锁，
+# 其 import gprMax（内部也 import h5py）将永久阻塞
+import h5py
 
 def sh(cmd, env=None):
     print(">>", " ".join(map(str, cmd)))
@@ -9,6 +16,16 @@ def sh(cmd, env=None):
         sys.exit(r.returncode)
 
 def autodetect_gpus():
+    # 优先走 NVML（进程内库调用，微秒级）；pynvml 不可用再退回 fork nvidia-smi（~200ms）
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            return [str(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        finally:
+            pynvml.nvmlShutdown()
+    except Exception:
+        pass
     try:
         out = subprocess.check_output(
             ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"]
@@ -17,47 +34,93 @@ def autodetect_gpus():
     except Exception:
         return []
 
-def split_runs_by_weights(total_runs, weights):
-    total_weight = sum(weights)
-    sizes = [round(total_runs * w / total_weight) for w in weights]
-    # 调整四舍五入误差
-    diff = total_runs - sum(sizes)
-    for i in range(abs(diff)):
-        idx = i % len(sizes)
-        sizes[idx] += 1 if diff > 0 else -1
-    ranges = []
-    start = 1
-    for sz in sizes:
-        end = min(total_runs, start + sz - 1)
-        ranges.append((start, end))
-        start = end + 1
-    return ranges
-
-def modify_in_file(infile, out_infile, r1, r2, total_runs):
-    # 复制 .in 文件并修改 #src_steps 和 #rx_steps
-    shutil.copy(infile, out_infile)
-    with open(out_infile, 'r') as f:
-        lines = f.readlines()
-    with open(out_infile, 'w') as f:
-        for line in lines:
-            if line.startswith('#src_steps'):
-                # 修改步进：假设原步进为 dx dy dz，调整为子区间
-                parts = line.split()
-                # 简单：保持步进，但后续用 -n (r2-r1+1) 限制 runs
-                f.write(line)
-            elif line.startswith('#rx_steps'):
-                f.write(line)
-            else:
-                f.write(line)
-    # 注意：实际分区需根据步进计算起始位置，这里简化，只用 -n 限制 runs 数
-    return out_infile
+def worker_init(gpu_id):
+    # 在 import gprMax 之前固定本进程可见的 GPU，之后进程内设备号恒为 0
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+    if not os.environ.get("DISPLAY"):
+        os.environ["MPLBACKEND"] = "Agg"
+
+def run_task(infile, total_runs, task, geometry_fixed):
+    # 进程内直接调用 gprMax API：常驻进程只付一次 import/CUDA 上下文开销
+    from gprMax.gprMax import api
+    api(infile, n=total_runs, task=task, gpu=[0], geometry_fixed=geometry_fixed)
+
+def merger_worker(prefix, total_runs, done_q, status):
+    # 增量合并：GPU 还在算后面的 task 时就把已完成的 .out 并进 _merged.out，
+    # 把合并开销移出关键路径；全部跑完后只剩绘图（流水线化）
+    merged = prefix + "_merged.out"
+    fout = None
+    merged_count = 0
+    merged_files = []
+    try:
+        while merged_count < total_runs:
+            task = done_q.get()
+            if task is None:
+                # 有任务失败：放弃增量合并，留给调用者处理
+                return
+            fname = f"{prefix}{task}.out"
+            with h5py.File(fname, 'r') as fin:
+                nrx = fin.attrs['nrx']
+                if fout is None:
+                    fout = h5py.File(merged, 'w')
+                    fout.attrs['Title'] = fin.attrs['Title']
+                    fout.attrs['gprMax'] = fin.attrs['gprMax']
+                    fout.attrs['Iterations'] = fin.attrs['Iterations']
+                    fout.attrs['dt'] = fin.attrs['dt']
+                    fout.attrs['nrx'] = nrx
+                    for rx in range(1, nrx + 1):
+                        path = '/rxs/rx' + str(rx)
+                        grp = fout.create_group(path)
+                        for output in fin[path].keys():
+                            grp.create_dataset(output, (fout.attrs['Iterations'], total_runs),
+                                               dtype=fin[path + '/' + output].dtype)
+                # task 编号即合并文件中的道号
+                for rx in range(1, nrx + 1):
+                    path = '/rxs/rx' + str(rx) + '/'
+                    for output in fin[path].keys():
+                        fout[path + output][:, task - 1] = fin[path + output][:]
+            # 不立刻删：中途有任务失败时保留全部 per-task .out，
+            # 失败的 task 可单独用 -task 重跑后再合并，不必整轮重来
+            merged_files.append(fname)
+            merged_count += 1
+        status["ok"] = True
+        for fname in merged_files:
+            os.remove(fname)
+    except Exception as e:
+        print(f"Incremental merge failed: {e}")
+    finally:
+        if fout is not None:
+            fout.close()
+
+def gpu_worker(gpu_id, tasks, lock, infile, total_runs, geometry_fixed, results, done_q):
+    # 每块 GPU 一个常驻工作进程；空闲即从共享队列偷下一个 task（work stealing），
+    # 快 GPU 自然多干活，不再被静态权重分配拖慢
+    done = 0
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=1, initializer=worker_init, initargs=(gpu_id,)) as ex:
+        while True:
+            with lock:
+                try:
+                    task = tasks.popleft()
+                except IndexError:
+                    break
+            print(f"GPU {gpu_id}: running task {task}/{total_runs}")
+            try:
+                ex.submit(run_task, infile, total_runs, task, geometry_fixed).result()
+            except Exception as e:
+                print(f"GPU {gpu_id} task {task} failed: {e}")
+                results[gpu_id] = (time.time() - start_time, done, 1)
+                done_q.put(None)
+                return
+            done += 1
+            done_q.put(task)
+    results[gpu_id] = (time.time() - start_time, done, 0)
 
 def main():
-    ap = argparse.ArgumentParser(description="Run gprMax with GPUs, split runs by weights, then merge and plot B-scan.")
+    ap = argparse.ArgumentParser(description="Run gprMax with GPUs (dynamic work stealing), then merge and plot B-scan.")
     ap.add_argument("--infile", required=True, help=".in file")
     ap.add_argument("--runs", type=int, required=True, help="Total runs for -n")
     ap.add_argument("--gpus", default="", help="Comma-separated GPU ids, e.g. '0,1'. If empty, use all visible GPUs.")
-    ap.add_argument("--weights", default="1,2", help="Comma-separated weights for GPUs, e.g. '1,2' (same length as --gpus). If empty, equal weights.")
     ap.add_argument("--comp", default="Ez", help="Field component for plot_Bscan (e.g. Ez)")
     ap.add_argument("--geometry-fixed", action="store_true", help="Pass --geometry-fixed to speed B-scan")
     args = ap.parse_args()
@@ -76,68 +139,49 @@ def main():
             print("No GPUs found. Use --gpus to specify GPU ids.")
             sys.exit(1)
 
-    # 解析权重
-    if args.weights.strip():
-        weights = [float(w.strip()) for w in args.weights.split(",") if w.strip()]
-        if len(weights) != len(gpu_ids):
-            print("Weights length must match GPUs length.")
-            sys.exit(1)
-    else:
-        weights = [1.0] * len(gpu_ids)  # 默认等权重
-
-    # 计算每个 GPU 的 runs 区间
-    ranges = split_runs_by_weights(args.runs, weights)
-    print(f"GPU assignments: {list(zip(gpu_ids, ranges))}")
-
     # 环境设置
     env = os.environ.copy()
+    # 子进程跳过 user site、不写 .pyc，减小 CPython 启动开销
+    env["PYTHONNOUSERSITE"] = "1"
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
     if not env.get("DISPLAY"):
         env["MPLBACKEND"] = "Agg"
 
-    # 为每个 GPU 生成分区 .in 文件并运行
-    procs = []
-    gpu_times = {}
-    for i, (gpu_id, (r1, r2)) in enumerate(zip(gpu_ids, ranges)):
-        if r1 > r2:
-            continue
-        out_infile = f"{args.infile.rsplit('.', 1)[0]}_gpu{i}.in"
-        modify_in_file(args.infile, out_infile, r1, r2, args.runs)
-        cmd = [sys.executable, "-m", "gprMax", out_infile, "-n", str(r2 - r1 + 1), "-gpu", gpu_id]
-        if args.geometry_fixed:
-            cmd.append("--geometry-fixed")
-        print(f"Launching GPU {gpu_id}: runs {r1}-{r2} with {out_infile}")
-        start_time = time.time()
-        p = subprocess.Popen(cmd, env=env)
-        procs.append((p, gpu_id, start_time))
-
-    # 等待所有并记录时间
-    rc = 0
-    for p, gpu_id, start_time in procs:
-        p.wait()
-        end_time = time.time()
-        gpu_times[gpu_id] = end_time - start_time
-        rc |= p.returncode or 0
-    if rc != 0:
-        print("Some GPU runs failed.")
-        sys.exit(rc)
+    # 共享任务队列：task 1..N，哪块 GPU 先空闲就取下一个
+    tasks = deque(range(1, args.runs + 1))
+    lock = threading.Lock()
+    results = {}
+    # splitext 而非 rsplit("."): 目录名带 "." 时也正确
+    prefix = os.path.splitext(args.infile)[0]
+
+    # 合并线程与 GPU 并行跑：每完成一个 task 立即并入 _merged.out
+    done_q = queue.Queue()
+    merge_status = {"ok": False}
+    merger = threading.Thread(target=merger_worker, args=(prefix, args.runs, done_q, merge_status))
+    merger.start()
+
+    threads = []
+    for gpu_id in gpu_ids:
+        t = threading.Thread(target=gpu_worker,
+                             args=(gpu_id, tasks, lock, args.infile, args.runs, args.geometry_fixed, results, done_q))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    merger.join()
 
     # 打印时间统计
+    rc = 0
     print("\nGPU Time Statistics:")
-    for gpu_id, t in gpu_times.items():
-        print(f"GPU {gpu_id}: {t:.2f} seconds")
-
-    # 重命名输出文件以匹配合并
-    prefix = args.infile.rsplit(".", 1)[0]
-    for i, (gpu_id, (r1, r2)) in enumerate(zip(gpu_ids, ranges)):
-        gpu_prefix = f"{args.infile.rsplit('.', 1)[0]}_gpu{i}"
-        for j in range(r1, r2 + 1):
-            old_out = f"{gpu_prefix}{j}.out"
-            new_out = f"{prefix}{j}.out"
-            if os.path.exists(old_out):
-                os.rename(old_out, new_out)
-
-    # 合并与绘图
-    sh([sys.executable, "-m", "tools.outputfiles_merge", prefix, "--remove-files"], env=env)
+    for gpu_id in gpu_ids:
+        t, done, failed = results.get(gpu_id, (0.0, 0, 1))
+        print(f"GPU {gpu_id}: {t:.2f} seconds, {done} tasks")
+        rc |= failed
+    if rc != 0 or tasks or not merge_status["ok"]:
+        print("Some GPU runs failed.")
+        sys.exit(1)
+
+    # 合并已随跑随做，只剩绘图
     merged = f"{prefix}_merged.out"
     print("Plotting B-scan using tools.plot_Bscan...")
     sh([sys.executable, "-m", "tools.plot_Bscan", merged, args.comp], env=env)
@@ -1,64 +1,117 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, subprocess, sys, os, time
+import subprocess, sys, os, threading
 from collections import deque
 
+# worker -> scheduler 完成确认 token（夹在 gprMax 的正常输出之间，需可辨识）
+TOKEN_DONE = "__CHUNK_DONE__"
+TOKEN_FAIL = "__CHUNK_FAIL__"
+
+# 子进程统一环境：跳过 user site、不写 .pyc，减小每个 task/worker 的 CPython 启动开销
+CHILD_ENV = {**os.environ, "PYTHONNOUSERSITE": "1", "PYTHONDONTWRITEBYTECODE": "1"}
+
 def sh(cmd):
     print(">>", " ".join(map(str, cmd)))
-    r = subprocess.run(cmd)
+    r = subprocess.run(cmd, env=CHILD_ENV)
     if r.returncode != 0:
         sys.exit(r.returncode)
 
-def run_tasks_on_gpu(pyexe, infile, total_runs, gpu_id, r1, r2):
-    # 逐个 task 执行，避免使用不存在的 -r 选项
-    for i in range(r1, r2 + 1):
-        cmd = [pyexe, "-m", "gprMax", infile, "-n", str(total_runs), "-task", str(i), "-gpu", str(gpu_id)]
-        print(f"GPU {gpu_id}: running task {i}/{total_runs}")
-        r = subprocess.run(cmd)
-        if r.returncode != 0:
-            return r.returncode
+def worker_loop(infile, total_runs):
+    # 常驻 worker：进程生命周期内只 import 一次 gprMax、建一次 CUDA 上下文，
+    # 从 stdin 逐行读 "r1 r2" 任务区间，完成后输出确认 token；stdin 关闭即退出。
+    # CUDA_VISIBLE_DEVICES 由调度进程在启动前设好，进程内设备号恒为 0
+    from gprMax.gprMax import api
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        r1, r2 = map(int, line.split())
+        ok = True
+        for i in range(r1, r2 + 1):
+            try:
+                api(infile, n=total_runs, task=i, gpu=[0])
+            except Exception as e:
+                print(f"task {i} failed: {e}", file=sys.stderr)
+                ok = False
+                break
+        print(f"{TOKEN_DONE if ok else TOKEN_FAIL} {r1} {r2}", flush=True)
     return 0
 
-def launch_chunk_worker(pyexe, script_path, infile, total_runs, r1, r2, gpu_id):
-    cmd = [pyexe, script_path, "--worker",
-           "--infile", infile,
-           "--runs", str(total_runs),
-           "--gpu", str(gpu_id),
-           "--range", str(r1), str(r2)]
-    print(f"Launching GPU {gpu_id}: tasks {r1}-{r2}")
-    return subprocess.Popen(cmd)
-
-def make_chunks(N, chunk_size):
-    chunks = []
-    s = 1
-    while s <= N:
-        e = min(N, s + chunk_size - 1)
-        chunks.append((s, e))
-        s = e + 1
-    return deque(chunks)
+def launch_gpu_worker(pyexe, script_path, infile, total_runs, gpu_id):
+    # 在 import gprMax 之前（启动时）通过 env 钉死该 worker 可见的 GPU
+    env = CHILD_ENV.copy()
+    env["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+    cmd = [pyexe, script_path, "--worker", "--infile", infile, "--runs", str(total_runs)]
+    print(f"Launching persistent worker for GPU {gpu_id}")
+    return subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, text=True, bufsize=1)
+
+def take_chunk(tasks, max_batch):
+    # 批量领取：空闲 GPU 一次拿走剩余队列的一半（上限 max_batch），而不是固定大小的块；
+    # 开局大块摊薄每次派发的往返开销，收尾自动变细粒度，避免最后一块拖尾。
+    # 队列是连续编号，弹出 k 个即得到连续区间 [r1, r2]
+    if not tasks:
+        return None
+    k = max(1, min(max_batch, len(tasks) // 2))
+    r1 = tasks.popleft()
+    r2 = r1
+    for _ in range(k - 1):
+        r2 = tasks.popleft()
+    return r1, r2
+
+def feed_worker(gpu, proc, tasks, lock, max_batch, fails):
+    # 每块 GPU 一个调度线程：空闲即领下一批，写给常驻 worker 并等它的确认 token
+    while True:
+        with lock:
+            chunk = take_chunk(tasks, max_batch)
+        if chunk is None:
+            break
+        r1, r2 = chunk
+        print(f"GPU {gpu}: tasks {r1}-{r2}")
+        try:
+            proc.stdin.write(f"{r1} {r2}\n")
+            proc.stdin.flush()
+        except OSError:
+            # worker 已死（BrokenPipe 等）：记下丢失的 chunk 再退出，
+            # 否则 main 看不到失败、会拿着缺道的结果去合并
+            fails.append((gpu, chunk))
+            break
+        status = None
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            if line.startswith((TOKEN_DONE, TOKEN_FAIL)):
+                status = line
+                break
+            # 透传 worker/gprMax 的常规输出
+            print(line)
+        if status is None or status.startswith(TOKEN_FAIL):
+            fails.append((gpu, chunk))
+            break
+    try:
+        proc.stdin.close()
+    except OSError:
+        pass
+    rc = proc.wait()
+    if rc != 0:
+        fails.append((gpu, None))
 
 def main():
+    # argparse 只在真正作为脚本运行时才导入，降低被 import 时的冷启动
+    import argparse
     ap = argparse.ArgumentParser(description="Split -n runs across multiple GPUs (dynamic chunk scheduling), then merge and plot.")
     ap.add_argument("--infile", required=True, help=".in file")
     ap.add_argument("--runs", type=int, required=True, help="Total runs for -n (e.g., 60)")
     ap.add_argument("--gpus", default="0,1", help="Comma-separated GPU ids, e.g. '0,1'")
-    ap.add_argument("--chunk-size", type=int, default=10, help="Runs per chunk")
+    ap.add_argument("--chunk-size", type=int, default=10, help="Max runs granted per steal")
     ap.add_argument("--comp", default="Ez", help="Field component, e.g. Ez")
     ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
-    ap.add_argument("--gpu", help=argparse.SUPPRESS)
-    ap.add_argument("--range", nargs=2, type=int, help=argparse.SUPPRESS)
     args = ap.parse_args()
 
     pyexe = sys.executable
 
-    # 子进程模式：在指定 GPU 上跑一个区间的 tasks
+    # 子进程模式：常驻 worker，循环处理 stdin 里的任务区间
     if args.worker:
-        if not (args.gpu and args.range):
-            print("Worker missing --gpu/--range")
-            sys.exit(2)
-        r1, r2 = args.range
-        rc = run_tasks_on_gpu(pyexe, args.infile, args.runs, args.gpu, r1, r2)
-        sys.exit(rc)
+        sys.exit(worker_loop(args.infile, args.runs))
 
     # 主调度进程
     N = args.runs
@@ -67,40 +120,29 @@ def main():
         print("No GPUs specified.")
         sys.exit(1)
 
-    chunks = make_chunks(N, max(1, args.chunk_size))
-    active = {}
+    tasks = deque(range(1, N + 1))
+    max_batch = max(1, args.chunk_size)
+    lock = threading.Lock()
+    fails = []
     script_path = os.path.abspath(__file__)
 
-    # 先给每块 GPU 派一个 chunk
+    # 每块 GPU 一个常驻 worker + 一个喂任务的调度线程
+    threads = []
     for gpu in gpus:
-        if not chunks:
-            break
-        r1, r2 = chunks.popleft()
-        active[gpu] = (launch_chunk_worker(pyexe, script_path, args.infile, N, r1, r2, gpu), (r1, r2))
-
-    # 动态调度：哪个 GPU 先空闲就继续派下一个 chunk
-    rc = 0
-    while active:
-        finished = []
-        for gpu, (proc, rr) in list(active.items()):
-            ret = proc.poll()
-            if ret is not None:
-                rc |= (ret or 0)
-                finished.append(gpu)
-        for gpu in finished:
-            del active[gpu]
-            if chunks:
-                r1, r2 = chunks.popleft()
-                active[gpu] = (launch_chunk_worker(pyexe, script_path, args.infile, N, r1, r2, gpu), (r1, r2))
-        if active:
-            time.sleep(0.2)
+        proc = launch_gpu_worker(pyexe, script_path, args.infile, N, gpu)
+        t = threading.Thread(target=feed_worker, args=(gpu, proc, tasks, lock, max_batch, fails))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
 
-    if rc != 0:
+    if fails or tasks:
         print("Some chunks failed.")
-        sys.exit(rc)
+        sys.exit(1)
 
     # 合并并画图（PNG 将保存到 .out/.in 同目录）
-    prefix = args.infile.rsplit(".", 1)[0]
+    # splitext 而非 rsplit("."): 目录名带 "." 时也正确
+    prefix = os.path.splitext(args.infile)[0]
     sh([pyexe, "-m", "tools.outputfiles_merge", prefix, "--remove-files"])
     merged = f"{prefix}_merged.out"
     print("Plotting B-scan using official plot_Bscan.py...")
@@ -109,4 +151,4 @@ def main():
 if __name__ == "__main__":
     main()
 # 用法:
-# python run_bscan22.py --infile waterwood/test.in --runs 60 --gpus 0,1 --chunk-size 8 --comp Ez
\ No newline at end of file
+# python run_bscan22.py --infile waterwood/test.in --runs 60 --gpus 0,1 --chunk-size 8 --comp Ez
@@ -1,17 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, subprocess, sys
+import subprocess, sys
 import os, re
 
+# 子进程统一环境：跳过 user site、不写 .pyc，减小每次 CPython 启动开销
+CHILD_ENV = {**os.environ, "PYTHONNOUSERSITE": "1", "PYTHONDONTWRITEBYTECODE": "1"}
+
 def sh(cmd):
     print(">>", " ".join(cmd))
-    r = subprocess.run(cmd)
+    r = subprocess.run(cmd, env=CHILD_ENV)
     if r.returncode != 0:
         sys.exit(r.returncode)
     return r
 
 def get_mute_ns_from_in(infile:str):
-    # 调 tools.mute 解析推荐的 --mute_ns 数值
+    # 直接 import tools.mute 计算 t_end，免去一次解释器启动 + stdout 正则往返
+    try:
+        from tools.mute import parse_infile, infer_epsr_for_txrx, compute_mute
+    except ImportError:
+        return get_mute_ns_from_in_subprocess(infile)
+    try:
+        materials, boxes, waveform, tx, rx = parse_infile(infile)
+        if tx is None or rx is None or waveform is None:
+            print("tools.mute: missing Tx/Rx/waveform in", infile)
+            return None
+        epsr = infer_epsr_for_txrx(materials, boxes, tx, rx, default_epsr=1.0)
+        d, v, t_direct, main_lobe, t_end = compute_mute(epsr, tx, rx, waveform[2], k=0.8)
+        return t_end * 1e9
+    except Exception as e:
+        print("tools.mute failed:", e)
+        return None
+
+def get_mute_ns_from_in_subprocess(infile:str):
+    # 兜底：调 tools.mute 子进程解析推荐的 --mute_ns 数值
     r = subprocess.run([sys.executable, "-m", "tools.mute", "--infile", infile],
                        capture_output=True, text=True)
     if r.returncode != 0:
@@ -27,22 +48,29 @@ def get_mute_ns_from_in(infile:str):
     return None
 
 def main():
+    # argparse 只在真正作为脚本运行时才导入，降低被 import 时的冷启动
+    import argparse
     ap = argparse.ArgumentParser(description="Run gprMax (-n), merge, plot PNG with mute.")
     ap.add_argument("--infile", default="t1003/test7.in", help=".in file (contains #src_steps/#rx_steps)")
     ap.add_argument("--runs", default=60,type=int, help="N for -n (e.g., 60)")
     ap.add_argument("--gpu", default=0,type=int, help="GPU id")
     ap.add_argument("--comp", default="Ez", help="field component, default Ez")
     ap.add_argument("--mute_ns", type=float, default=None, help="override mute window (ns); if omitted, auto-compute")
+    ap.add_argument("--geometry-fixed", action="store_true", help="pass --geometry-fixed to gprMax (skip geometry rebuild per run)")
+    ap.add_argument("--wait-plot", action="store_true", help="block until the B-scan PNG is written (default: plot in a background process)")
     args = ap.parse_args()
 
     # 1) simulate
     cmd = [sys.executable, "-m", "gprMax", args.infile, "-n", str(args.runs)]
     if args.gpu is not None:
         cmd += ["-gpu", str(args.gpu)]
+    if args.geometry_fixed:
+        cmd.append("--geometry-fixed")
     sh(cmd)
 
     # 2) merge (and remove individuals)
-    prefix = args.infile.rsplit(".",1)[0]
+    # splitext 而非 rsplit("."): 目录名带 "." 时也正确
+    prefix = os.path.splitext(args.infile)[0]
     sh([sys.executable, "-m", "tools.outputfiles_merge", prefix, "--remove-files"])
     merged = f"{prefix}_merged.out"
 
@@ -60,7 +88,16 @@ def main():
     plot_cmd = [sys.executable, "-m", "tools.plot_Bscan_nodirect_1002", merged, args.comp]
     if mute_ns is not None:
         plot_cmd += ["--mute_ns", f"{mute_ns:.3f}"]
-    sh(plot_cmd)
+    if args.wait_plot:
+        sh(plot_cmd)
+    else:
+        # 出图放到脱离会话的后台进程，脚本立即返回
+        log = f"{prefix}_plot.log"
+        print(">> (background)", " ".join(plot_cmd))
+        with open(log, "w") as lf:
+            subprocess.Popen(plot_cmd, start_new_session=True, stdout=lf, stderr=subprocess.STDOUT,
+                             env={**CHILD_ENV, "MPLBACKEND": "Agg"})
+        print(f"Plotting in background; log: {log}")
 
 if __name__ == "__main__":
     main()
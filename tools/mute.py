@@ -16,25 +16,38 @@ Outputs:
 import argparse, math, os, re
 from typing import Dict, Tuple, Optional
 
-CMD = re.compile(r'^\s*#\s*([a-zA-Z_]+)\s*:\s*(.*)$')
+CMD = re.compile(r'#\s*([a-zA-Z_]+)\s*:\s*(.*)')
+
+# Commands parse_infile cares about; everything else is skipped without tokenizing
+KEYS = frozenset(('material', 'box', 'waveform', 'hertzian_dipole', 'rx'))
 
 def parse_infile(path:str):
     materials: Dict[str, float] = {}   # name -> epsr
-    boxes = []  # list of (x1,y1,z1,x2,y2,z2,material_name)
+    boxes = []  # list of (x1,y1,z1,x2,y2,z2,material_name); only boxes containing Tx/Rx survive
+    box_toks = []  # raw #box tokens; converted/filtered once tx/rx are known
     waveform = None  # ('ricker', amplitude, fc, name)
     tx = None  # (x,y,z)
     rx = None  # (x,y,z)
 
     with open(path, 'r', encoding='utf-8') as f:
         for raw in f:
-            m = CMD.match(raw)
+            s = raw.lstrip()
+            # 便宜的前置过滤：非 # 行连正则都不用碰
+            if not s.startswith('#'):
+                continue
+            m = CMD.match(s)
             if not m:
                 continue
-            key = m.group(1).strip().lower()
-            args = m.group(2).strip()
-            toks = args.split()
+            key = m.group(1).lower()
+            if key not in KEYS:
+                continue
+            toks = m.group(2).split()
 
-            if key == 'material' and len(toks) >= 5:
+            if key == 'box' and len(toks) >= 7:
+                # #box: x1 y1 z1 x2 y2 z2 material —— 先存原始 token，最后再统一转换
+                box_toks.append(toks)
+
+            elif key == 'material' and len(toks) >= 5:
                 # #material: epsr sigma mur kappa name
                 try:
                     epsr = float(toks[0])
@@ -45,14 +58,6 @@ def parse_infile(path:str):
                     name = toks[-1]
                 materials[name] = epsr
 
-            elif key == 'box' and len(toks) >= 7:
-                # #box: x1 y1 z1 x2 y2 z2 material
-                x1,y1,z1,x2,y2,z2 = map(float, toks[:6])
-                matname = toks[6]
-                # normalize order
-                xlo,xhi = sorted([x1,x2]); ylo,yhi = sorted([y1,y2]); zlo,zhi = sorted([z1,z2])
-                boxes.append((xlo,ylo,zlo,xhi,yhi,zhi,matname))
-
             elif key == 'waveform' and len(toks) >= 4:
                 # #waveform: ricker amp fc name
                 wtype = toks[0].lower()
@@ -78,6 +83,33 @@ def parse_infile(path:str):
                 except Exception:
                     pass
 
+    # Bulk-convert box coordinates at C speed when there are many of them;
+    # the scalar path stays for small files (and as fallback without numpy)
+    coords = None
+    if len(box_toks) > 100:
+        try:
+            import numpy as np
+            coords = np.array([toks[:6] for toks in box_toks], dtype=float)
+        except Exception:
+            coords = None
+
+    # Only boxes that contain Tx or Rx matter for the epsilon inference, so the
+    # point_in_box loop in infer_epsr_for_txrx stays O(1) on box-heavy files
+    for i, toks in enumerate(box_toks):
+        if coords is not None:
+            x1,y1,z1,x2,y2,z2 = coords[i]
+        else:
+            try:
+                x1,y1,z1,x2,y2,z2 = map(float, toks[:6])
+            except Exception:
+                continue
+        matname = toks[6]
+        # normalize order
+        xlo,xhi = sorted([x1,x2]); ylo,yhi = sorted([y1,y2]); zlo,zhi = sorted([z1,z2])
+        b = (xlo,ylo,zlo,xhi,yhi,zhi,matname)
+        if (tx is not None and point_in_box(tx, b)) or (rx is not None and point_in_box(rx, b)):
+            boxes.append(b)
+
     return materials, boxes, waveform, tx, rx
 
 def point_in_box(p, box)->bool: